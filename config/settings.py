@@ -48,6 +48,10 @@ DATABASES = {
         "NAME": BASE_DIR / "db" / "db.sqlite3",
     }
 }
+# X-Forwarded-For を付与する信頼できるプロキシの段数。Procfile でデプロイする
+# Herokuのルーター配下を想定して1。プロキシを通さず公開する場合 (docker-compose) は0にする。
+# 0 の場合は REMOTE_ADDR をクライアントIPとして使う
+PREFETCH_TRUSTED_PROXY_COUNT = int(os.getenv("PREFETCH_TRUSTED_PROXY_COUNT", "1"))
 STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
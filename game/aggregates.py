@@ -0,0 +1,128 @@
+# game/aggregates.py
+
+from django.db import transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Score, PlayerStats, ScoreHistogramBucket
+
+
+def record_score(score) -> None:
+    """
+    新しく作成されたScoreをプレイヤー集計とスコア分布に反映する。
+    Scoreの件数に関係なく、更新する行は2行だけ (O(1))。
+    ScoreView と同じトランザクション内で呼ぶ想定。
+    """
+    stats, _ = PlayerStats.objects.get_or_create(player_id=score.player_id)
+    # 同時送信でも取りこぼさないよう、DB側で加算する
+    PlayerStats.objects.filter(pk=stats.pk).update(
+        games_played=F("games_played") + 1,
+        total_score=F("total_score") + score.score,
+        # best_score が NULL だと Greatest が NULL を返すDBがあるため Coalesce する
+        best_score=Greatest(
+            Coalesce(F("best_score"), Value(score.score)), Value(score.score)
+        ),
+        updated_at=timezone.now(),  # update() では auto_now が効かないため明示する
+    )
+
+    ScoreHistogramBucket.objects.get_or_create(score=score.score)
+    ScoreHistogramBucket.objects.filter(score=score.score).update(count=F("count") + 1)
+
+
+def get_percentile(score_value: int) -> dict:
+    """
+    指定したスコアが全スコアの中で何パーセンタイルかを分布テーブルから求める。
+    同点は半分を下位に数える (mid-rank)。集計対象は分布の行数だけで、Scoreは走査しない。
+    """
+    buckets = ScoreHistogramBucket.objects.all()
+    total = buckets.aggregate(n=Sum("count"))["n"] or 0
+    below = buckets.filter(score__lt=score_value).aggregate(n=Sum("count"))["n"] or 0
+    equal = (
+        buckets.filter(score=score_value).values_list("count", flat=True).first() or 0
+    )
+
+    if not total:
+        return {"percentile": None, "total": 0}
+    return {
+        "percentile": (below + equal / 2) / total * 100,
+        "total": total,
+    }
+
+
+def _fold_scores(rows, player_totals: dict, histogram: dict) -> None:
+    # rows: (pk, player_id, score) のリスト
+    for _, player_id, score in rows:
+        totals = player_totals.setdefault(player_id, [0, 0, score])
+        totals[0] += 1
+        totals[1] += score
+        totals[2] = max(totals[2], score)
+        histogram[score] = histogram.get(score, 0) + 1
+
+
+def rebuild_aggregates(chunk_size: int = 5000, log=print) -> dict:
+    """
+    Scoreを主キー順にchunk_size件ずつ読み込み、プレイヤー集計とスコア分布を作り直す。
+    読み込み中に作成されたScoreは、置き換え用トランザクションの中で追加で読み込むため、
+    送信を止めずに実行しても取りこぼさない。
+    """
+
+    def read_chunk(after_pk):
+        return list(
+            Score.objects.filter(pk__gt=after_pk)
+            .order_by("pk")
+            .values_list("pk", "player_id", "score")[:chunk_size]
+        )
+
+    # player_id -> [games_played, total_score, best_score]
+    player_totals = {}
+    # score -> count
+    histogram = {}
+
+    # 主キー順に読み込む (OFFSETを使わないので後半も遅くならない)
+    last_pk = 0
+    processed = 0
+    while chunk := read_chunk(last_pk):
+        _fold_scores(chunk, player_totals, histogram)
+        last_pk = chunk[-1][0]
+        processed += len(chunk)
+        log(f"processed {processed} scores")
+
+    with transaction.atomic():
+        # 先に削除して書き込みロックを取り、その後に作成されたScoreを追加で反映する
+        PlayerStats.objects.all().delete()
+        ScoreHistogramBucket.objects.all().delete()
+        while chunk := read_chunk(last_pk):
+            _fold_scores(chunk, player_totals, histogram)
+            last_pk = chunk[-1][0]
+            processed += len(chunk)
+
+        PlayerStats.objects.bulk_create(
+            [
+                PlayerStats(
+                    player_id=player_id,
+                    games_played=games_played,
+                    total_score=total_score,
+                    best_score=best_score,
+                )
+                for player_id, (
+                    games_played,
+                    total_score,
+                    best_score,
+                ) in player_totals.items()
+            ],
+            batch_size=chunk_size,
+        )
+        ScoreHistogramBucket.objects.bulk_create(
+            [
+                ScoreHistogramBucket(score=score, count=count)
+                for score, count in histogram.items()
+            ],
+            batch_size=chunk_size,
+        )
+
+    return {
+        "scores": processed,
+        "players": len(player_totals),
+        "buckets": len(histogram),
+    }
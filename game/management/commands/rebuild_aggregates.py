@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from game.aggregates import rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = "Scoreからプレイヤー集計とスコア分布をチャンク単位で再構築"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        result = rebuild_aggregates(
+            chunk_size=options["chunk_size"], log=self.stdout.write
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ {result['scores']}件のスコアから集計を再構築 (players: {result['players']}, buckets: {result['buckets']})"
+            )
+        )
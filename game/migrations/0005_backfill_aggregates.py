@@ -0,0 +1,66 @@
+from django.db import migrations
+
+CHUNK_SIZE = 5000
+
+
+def backfill_aggregates(apps, schema_editor):
+    # 既存のScoreからプレイヤー集計・スコア分布を作る。
+    # アプリのコードが変わっても結果が変わらないよう、履歴モデルだけで処理する
+    Score = apps.get_model("game", "Score")
+    PlayerStats = apps.get_model("game", "PlayerStats")
+    ScoreHistogramBucket = apps.get_model("game", "ScoreHistogramBucket")
+
+    # player_id -> [games_played, total_score, best_score]
+    player_totals = {}
+    # score -> count
+    histogram = {}
+
+    last_pk = 0
+    while True:
+        chunk = list(
+            Score.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", "player_id", "score")[:CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        for _, player_id, score in chunk:
+            totals = player_totals.setdefault(player_id, [0, 0, score])
+            totals[0] += 1
+            totals[1] += score
+            totals[2] = max(totals[2], score)
+            histogram[score] = histogram.get(score, 0) + 1
+        last_pk = chunk[-1][0]
+
+    PlayerStats.objects.all().delete()
+    ScoreHistogramBucket.objects.all().delete()
+    PlayerStats.objects.bulk_create(
+        [
+            PlayerStats(
+                player_id=player_id,
+                games_played=games_played,
+                total_score=total_score,
+                best_score=best_score,
+            )
+            for player_id, (games_played, total_score, best_score) in player_totals.items()
+        ],
+        batch_size=CHUNK_SIZE,
+    )
+    ScoreHistogramBucket.objects.bulk_create(
+        [
+            ScoreHistogramBucket(score=score, count=count)
+            for score, count in histogram.items()
+        ],
+        batch_size=CHUNK_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_prefetchedembedding'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
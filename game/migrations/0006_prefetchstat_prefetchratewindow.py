@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("game", "0005_backfill_aggregates"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PrefetchRateWindow",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=128, unique=True)),
+                ("window", models.BigIntegerField()),
+                ("count", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="PrefetchStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=64, unique=True)),
+                ("count", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="prefetchedembedding",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
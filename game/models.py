@@ -11,6 +11,40 @@ class Word(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class PrefetchedEmbedding(models.Model):
+    """
+    入力中に先読みしたembedding。送信されるまではWordに入れず、
+    単語マップ・ターゲット候補・UMAPの対象に含めない。
+    送信時に ensure_word がWordへ移す。
+    """
+
+    text = models.CharField(max_length=128, unique=True)
+    embedding = models.JSONField()
+    created_at = models.DateTimeField(
+        auto_now_add=True, db_index=True
+    )  # 期限切れ削除用
+
+
+class PrefetchStat(models.Model):
+    """
+    先読みの集計カウンタ (リクエスト数・送信時のヒット数など)。F()で加算する。
+    """
+
+    name = models.CharField(max_length=64, unique=True)
+    count = models.BigIntegerField(default=0)
+
+
+class PrefetchRateWindow(models.Model):
+    """
+    先読みのレート制限用カウンタ。キーごとに現在の固定ウィンドウの番号と回数を1行で持つ。
+    """
+
+    # "種類:ハッシュ" の形式 (生の入力は保存しない)
+    key = models.CharField(max_length=128, unique=True)
+    window = models.BigIntegerField()  # int(time.time() // ウィンドウ秒数)
+    count = models.IntegerField(default=0)
+
+
 class Player(models.Model):
     name = models.CharField(max_length=64, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -31,3 +65,33 @@ class Score(models.Model):
     similarities = models.JSONField()
     score = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+
+class PlayerStats(models.Model):
+    """
+    プレイヤーごとの集計値。Score作成時に game.aggregates.record_score で逐次更新する。
+    """
+
+    player = models.OneToOneField(
+        Player, on_delete=models.CASCADE, related_name="stats"
+    )
+    games_played = models.IntegerField(default=0)
+    total_score = models.BigIntegerField(default=0)
+    best_score = models.IntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_score(self):
+        if not self.games_played:
+            return None
+        return self.total_score / self.games_played
+
+
+class ScoreHistogramBucket(models.Model):
+    """
+    全スコアの分布 (スコア値ごとの件数)。スコアは整数なので値ごとに1行持つ。
+    行数はスコアの取りうる範囲で上限があり、Scoreの件数には依存しない。
+    """
+
+    score = models.IntegerField(unique=True)
+    count = models.BigIntegerField(default=0)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Word, Target, Score, Player
+from .models import Word, Target, Score, Player, PlayerStats
 
 
 class WordSerializer(serializers.ModelSerializer):
@@ -24,10 +24,15 @@ class ScoreSubmitSerializer(serializers.Serializer):
     )
 
 
+class PrefetchSerializer(serializers.Serializer):
+    player = serializers.CharField(max_length=64, required=False, default="anon")
+    word = serializers.CharField(max_length=128)
+
+
 class ScoreResponseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Score
-        fields = ["score", "similarities"]
+        fields = ["id", "score", "similarities"]
 
 
 class PlayerScoreSerializer(serializers.Serializer):
@@ -35,3 +40,18 @@ class PlayerScoreSerializer(serializers.Serializer):
         source="player.name"
     )  # ここを 'player.name' に変更
     score = serializers.IntegerField()
+
+
+class PlayerStatsSerializer(serializers.ModelSerializer):
+    player_name = serializers.CharField(source="player.name")
+    average_score = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = PlayerStats
+        fields = [
+            "player_name",
+            "games_played",
+            "total_score",
+            "average_score",
+            "best_score",
+        ]
@@ -143,3 +143,19 @@ def update_all_word_coordinates_dbtask():
     print(
         f"[{task_end_time.strftime('%Y-%m-%d %H:%M:%S')}] UMAP coordinate update task finished. Duration: {task_end_time - task_start_time}"
     )
+
+
+@background(schedule=0)
+def prefetch_word_embedding_dbtask(text):
+    """
+    入力途中の単語のembeddingを先に取得してPrefetchedEmbeddingに保存しておくタスク。
+    ScoreView.post の時点で保存済みであれば、送信時のOpenAI呼び出しを省略できる。
+    """
+    # views が tasks を import しているため、循環importを避けて関数内で読み込む
+    from .views import prefetch_embedding
+
+    try:
+        prefetch_embedding(text)
+        print(f"Prefetched embedding for word '{text}'.")
+    except Exception as e:
+        print(f"Error prefetching embedding for word '{text}': {e}")
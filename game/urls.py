@@ -1,9 +1,20 @@
 from django.urls import path
-from .views import WordList, TargetView, ScoreView, ScoreRankingView
+from .views import (
+    WordList,
+    TargetView,
+    ScoreView,
+    ScoreRankingView,
+    PrefetchView,
+    ScorePercentileView,
+    PlayerStatsView,
+)
 
 urlpatterns = [
     path("words", WordList.as_view()),
     path("target", TargetView.as_view()),
     path("score", ScoreView.as_view()),
     path("ranking", ScoreRankingView.as_view()),
+    path("prefetch", PrefetchView.as_view()),
+    path("score/<int:pk>/percentile", ScorePercentileView.as_view()),
+    path("players/<str:name>/stats", PlayerStatsView.as_view()),
 ]
@@ -1,29 +1,50 @@
 # game/views.py
 
+import hashlib
+import time
+from datetime import timedelta
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.generics import ListAPIView  # RankingViewで使用
 from django.shortcuts import get_object_or_404
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from django.db.models import F, Case, When, Value
+from django.utils import timezone
 from django.conf import settings  # UMAP_UPDATE_THRESHOLD を読み込むため
 from openai import OpenAI
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 import umap  # ensure_word 内で個別の座標計算はしない方針に変更するなら不要になる可能性
 
-from .models import Word, Target, Score, Player
+from .models import (
+    Word,
+    Target,
+    Score,
+    Player,
+    PlayerStats,
+    PrefetchedEmbedding,
+    PrefetchStat,
+    PrefetchRateWindow,
+)
+from .aggregates import record_score, get_percentile
 from .serializers import (
     WordSerializer,  # WordListViewで使う想定（text, x, y を返すように変更が必要）
     TargetSerializer,
     ScoreSubmitSerializer,
     ScoreResponseSerializer,
+    PrefetchSerializer,
     PlayerScoreSerializer,  # RankingViewで使用
+    PlayerStatsSerializer,
 )
 
 # django-background-tasks のタスクをインポート
 try:
-    from .tasks import update_all_word_coordinates_dbtask
+    from .tasks import (
+        update_all_word_coordinates_dbtask,
+        prefetch_word_embedding_dbtask,
+    )
 
     BACKGROUND_TASK_LIB_AVAILABLE = True
 except ImportError:
@@ -39,6 +60,12 @@ except ImportError:
         )
         pass
 
+    def prefetch_word_embedding_dbtask(*args, **kwargs):
+        print(
+            "Dummy prefetch_word_embedding_dbtask called because actual task not found."
+        )
+        pass
+
 
 client = OpenAI()
 
@@ -68,16 +95,142 @@ def ensure_word(text: str) -> Word:
             word.save(update_fields=["embedding"])
     except Word.DoesNotExist:
         print(f"Word '{text}' not found. Creating new entry with embedding.")
-        embedding_data = get_embedding(text)
-        word = Word.objects.create(
-            text=text,
-            embedding=embedding_data,
-            tsne_x=None,  # 明示的にNoneで初期化
-            tsne_y=None,
-        )
+        # 先読み済みならそのembeddingを使い、OpenAIを呼ばずにWordへ移す
+        prefetched = PrefetchedEmbedding.objects.filter(text=text).first()
+        if prefetched:
+            embedding_data = prefetched.embedding
+        else:
+            embedding_data = get_embedding(text)
+        try:
+            # 先読みタスクと同時に作成された場合に備え、セーブポイント内で作成する
+            with transaction.atomic():
+                word = Word.objects.create(
+                    text=text,
+                    embedding=embedding_data,
+                    tsne_x=None,  # 明示的にNoneで初期化
+                    tsne_y=None,
+                )
+        except IntegrityError:
+            print(f"Word '{text}' was created concurrently. Using stored entry.")
+            word = Word.objects.get(text=text)
+        if prefetched:
+            prefetched.delete()
     return word
 
 
+def prefetch_embedding(text: str) -> None:
+    """
+    送信前の単語のembeddingを取得し、PrefetchedEmbeddingに保存する。
+    Wordには保存しないので、送信されなかった単語はゲームに現れない。
+    """
+    if (
+        Word.objects.filter(text=text, embedding__isnull=False).exists()
+        or PrefetchedEmbedding.objects.filter(text=text).exists()
+    ):
+        return
+    embedding_data = get_embedding(text)
+    PrefetchedEmbedding.objects.get_or_create(
+        text=text, defaults={"embedding": embedding_data}
+    )
+    purge_expired_prefetch_rows()
+
+
+def purge_expired_prefetch_rows() -> None:
+    """
+    送信されないまま期限 (PREFETCH_EMBEDDING_TTL 秒) を過ぎた先読みembeddingと、
+    終了したウィンドウのレート制限カウンタを削除する。先読みタスクの実行ごとに呼ぶ。
+    """
+    PREFETCH_EMBEDDING_TTL = getattr(settings, "PREFETCH_EMBEDDING_TTL", 60 * 60)
+    PREFETCH_RATE_WINDOW = getattr(settings, "PREFETCH_RATE_WINDOW", 60)
+    expired_before = timezone.now() - timedelta(seconds=PREFETCH_EMBEDDING_TTL)
+    deleted, _ = PrefetchedEmbedding.objects.filter(
+        created_at__lt=expired_before
+    ).delete()
+    if deleted:
+        print(f"Purged {deleted} expired prefetched embeddings.")
+    current_window = int(time.time() // PREFETCH_RATE_WINDOW)
+    PrefetchRateWindow.objects.filter(window__lt=current_window).delete()
+
+
+# --- Prefetch Helpers ---
+
+PREFETCH_STATS_KEYS = [
+    "requested",  # 先読みリクエスト総数
+    "already_stored",  # リクエスト時点で既に保存済み (語彙 or 先読み済み) だった
+    "queued",  # バックグラウンドタスクに投入した
+    "throttled",  # プレイヤー・IPごとのレート制限で拒否した
+    "budget_exceeded",  # 全体のOpenAI呼び出し予算を超えたため拒否した
+    "submit_vocabulary_hits",  # 送信時に既にWordにあった単語数 (先読みと無関係)
+    "submit_prefetch_hits",  # 送信時に先読み済みだった単語数 (先読みで省けたAPI呼び出し)
+    "submit_misses",  # 送信時に同期でembeddingを取得した単語数
+]
+
+
+def prefetch_rate_key(kind: str, value: str) -> str:
+    # ユーザー入力 (単語・プレイヤー名) はそのまま保存せず、固定長のハッシュにする
+    digest = hashlib.sha256(value.encode("utf-8")).hexdigest()
+    return f"{kind}:{digest}"
+
+
+def get_client_ip(request) -> str:
+    """
+    信頼できるプロキシ (settings.PREFETCH_TRUSTED_PROXY_COUNT 段) が付与した
+    X-Forwarded-For からクライアントIPを取り出す。クライアントが偽装できる左側の値は使わない。
+    """
+    proxy_count = getattr(settings, "PREFETCH_TRUSTED_PROXY_COUNT", 0)
+    forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
+    if proxy_count > 0 and forwarded_for:
+        addresses = [a.strip() for a in forwarded_for.split(",") if a.strip()]
+        if addresses:
+            return addresses[-min(proxy_count, len(addresses))]
+    return request.META.get("REMOTE_ADDR", "unknown")
+
+
+def incr_prefetch_stat(name: str, amount: int = 1):
+    if not amount:
+        return
+    PrefetchStat.objects.get_or_create(name=name)
+    # 複数ワーカーから同時に呼ばれても取りこぼさないよう、DB側で加算する
+    PrefetchStat.objects.filter(name=name).update(count=F("count") + amount)
+
+
+def get_prefetch_stats() -> dict:
+    counts = dict(
+        PrefetchStat.objects.filter(name__in=PREFETCH_STATS_KEYS).values_list(
+            "name", "count"
+        )
+    )
+    stats = {name: counts.get(name, 0) for name in PREFETCH_STATS_KEYS}
+    # 語彙に無かった単語のうち、先読みで送信時のembedding取得を省けた割合
+    not_in_vocabulary = stats["submit_prefetch_hits"] + stats["submit_misses"]
+    stats["prefetch_hit_rate"] = (
+        stats["submit_prefetch_hits"] / not_in_vocabulary if not_in_vocabulary else None
+    )
+    return stats
+
+
+def is_prefetch_allowed(kind: str, value: str, limit: int, window: int) -> bool:
+    """
+    固定ウィンドウ方式のレート制限。window秒ごとに最大limit回まで許可する。
+    カウンタはDBの1行で、加算とウィンドウの切り替えを1つのUPDATEで行う。
+    """
+    key = prefetch_rate_key(kind, value)
+    current_window = int(time.time() // window)
+    PrefetchRateWindow.objects.get_or_create(
+        key=key, defaults={"window": current_window}
+    )
+    # SETの右辺は更新前の値で評価されるので、count は古い window と比較される
+    PrefetchRateWindow.objects.filter(key=key).update(
+        count=Case(
+            When(window=current_window, then=F("count") + 1),
+            default=Value(1),
+        ),
+        window=current_window,
+    )
+    count = PrefetchRateWindow.objects.values_list("count", flat=True).get(key=key)
+    return count <= limit
+
+
 def calc_score(target_emb: list, choice_embs: list[list]) -> tuple[int, list]:
     # target_emb, choice_embs がNoneでないことを呼び出し元で保証する想定
     sims = sorted(
@@ -136,6 +289,77 @@ class TargetView(APIView):
         return Response(TargetSerializer(target).data)
 
 
+class PrefetchView(APIView):
+    """
+    入力中の単語のembeddingをバックグラウンドで先に取得する (フロントエンドからdebounceして呼ぶ)。
+    GET では先読みのヒット率などの統計を返す。
+    """
+
+    def get(self, request):
+        return Response(get_prefetch_stats())
+
+    def post(self, request):
+        serializer = PrefetchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        text = data["word"]  # CharField が前後の空白を除去済み (ScoreView と同じ正規化)
+        incr_prefetch_stat("requested")
+
+        # プレイヤー名は自由入力なので、名前とIPアドレスの両方で制限する
+        PREFETCH_RATE_LIMIT = getattr(settings, "PREFETCH_RATE_LIMIT", 30)
+        PREFETCH_RATE_WINDOW = getattr(settings, "PREFETCH_RATE_WINDOW", 60)
+        client_ip = get_client_ip(request)
+        if not (
+            is_prefetch_allowed(
+                "player", data["player"], PREFETCH_RATE_LIMIT, PREFETCH_RATE_WINDOW
+            )
+            and is_prefetch_allowed(
+                "ip", client_ip, PREFETCH_RATE_LIMIT, PREFETCH_RATE_WINDOW
+            )
+        ):
+            incr_prefetch_stat("throttled")
+            return Response(
+                {"detail": "Too many prefetch requests."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+
+        if (
+            Word.objects.filter(text=text, embedding__isnull=False).exists()
+            or PrefetchedEmbedding.objects.filter(text=text).exists()
+        ):
+            incr_prefetch_stat("already_stored")
+            return Response({"word": text, "status": "stored"})
+
+        # プレイヤー名は使い捨てにできるので、OpenAI呼び出しの総数にも上限を設ける
+        PREFETCH_GLOBAL_LIMIT = getattr(settings, "PREFETCH_GLOBAL_LIMIT", 120)
+        if not is_prefetch_allowed(
+            "global", "all", PREFETCH_GLOBAL_LIMIT, PREFETCH_RATE_WINDOW
+        ):
+            incr_prefetch_stat("budget_exceeded")
+            return Response(
+                {"detail": "Prefetch budget exceeded."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+
+        # 同じ単語のタスクが実行待ちなら重複して投入しない
+        if not is_prefetch_allowed("inflight", text, 1, PREFETCH_RATE_WINDOW):
+            return Response(
+                {"word": text, "status": "queued"}, status=status.HTTP_202_ACCEPTED
+            )
+
+        if not BACKGROUND_TASK_LIB_AVAILABLE:
+            return Response(
+                {"word": text, "status": "skipped"}, status=status.HTTP_202_ACCEPTED
+            )
+
+        prefetch_word_embedding_dbtask(text)
+        incr_prefetch_stat("queued")
+        return Response(
+            {"word": text, "status": "queued"}, status=status.HTTP_202_ACCEPTED
+        )
+
+
 class ScoreView(APIView):
     def post(self, request):
         serializer = ScoreSubmitSerializer(data=request.data)
@@ -155,6 +379,21 @@ class ScoreView(APIView):
 
         score_obj_data_for_response = None  # レスポンス用
 
+        # 先読みの効果測定: ensure_word が先読み分をWordへ移す前に内訳を数えておく
+        vocabulary_words = set(
+            Word.objects.filter(
+                text__in=words_unique, embedding__isnull=False
+            ).values_list("text", flat=True)
+        )
+        prefetched_words = (
+            set(
+                PrefetchedEmbedding.objects.filter(text__in=words_unique).values_list(
+                    "text", flat=True
+                )
+            )
+            - vocabulary_words
+        )
+
         with transaction.atomic():
             # ターゲット単語のembeddingを取得 (ensure_wordで確実に取得)
             target_word_obj = ensure_word(
@@ -185,8 +424,17 @@ class ScoreView(APIView):
                 similarities=sims,
                 score=score_int,
             )
+            record_score(score)  # プレイヤー集計・スコア分布を同じトランザクションで更新
             score_obj_data_for_response = ScoreResponseSerializer(score).data
 
+        # スコアが保存できた送信だけを集計する
+        incr_prefetch_stat("submit_vocabulary_hits", len(vocabulary_words))
+        incr_prefetch_stat("submit_prefetch_hits", len(prefetched_words))
+        incr_prefetch_stat(
+            "submit_misses",
+            len(words_unique) - len(vocabulary_words) - len(prefetched_words),
+        )
+
         # --- 座標未計算の単語数をチェックし、閾値を超えたらUMAP更新タスクを起動 ---
         UMAP_UPDATE_THRESHOLD = getattr(settings, "UMAP_UPDATE_THRESHOLD", 10)
         words_without_coords_count = Word.objects.filter(tsne_x__isnull=True).count()
@@ -223,3 +471,19 @@ class ScoreRankingView(ListAPIView):
         # 例: from django.db.models import Max
         #     top_players = Player.objects.annotate(max_score=Max('score__score')).order_by('-max_score')[:3]
         #     # この後、top_players に紐づく実際のScoreオブジェクトを取得するロジックなど
+
+
+class ScorePercentileView(APIView):
+    def get(self, request, pk):
+        # Scoreは主キーで1件取るだけで、分布は集計テーブルから求める
+        score = get_object_or_404(Score.objects.only("id", "score"), pk=pk)
+        result = get_percentile(score.score)
+        return Response({"id": score.id, "score": score.score, **result})
+
+
+class PlayerStatsView(APIView):
+    def get(self, request, name):
+        stats = get_object_or_404(
+            PlayerStats.objects.select_related("player"), player__name=name
+        )
+        return Response(PlayerStatsSerializer(stats).data)